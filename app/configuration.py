@@ -22,7 +22,7 @@ Note:
 
 import re
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from enum import Enum
 from typing import ClassVar
 import yaml
@@ -64,6 +64,9 @@ class MqttSettings:
     command_topic: str
     error_topic: str = None
     pub_errors: bool = False
+    error_batch_window: float = 0.0
+    socket_rcvbuf: int = None
+    socket_sndbuf: int = None
 
     def __post_init__(self):
         self.pub_errors = self.error_topic is not None and len(self.error_topic) > 0
@@ -73,6 +76,9 @@ class MqttSettings:
 class ModbusSettings:
     host: str
     port: int
+    idle_timeout: float = None
+    socket_rcvbuf: int = None
+    socket_sndbuf: int = None
 
 
 @dataclass
@@ -147,7 +153,7 @@ class Configuration:
         return self.mqtt_settings
 
     def get_modbus_settings(self) -> ModbusSettings:
-        return ModbusSettings(self.modbus_settings.host, self.modbus_settings.port)
+        return replace(self.modbus_settings)
 
     def get_site_settings(self) -> SiteSettings:
         return SiteSettings(
@@ -180,7 +186,13 @@ def _site_settings_from_yaml_data(data: dict) -> SiteSettings:
 
 def _modbus_settings_from_yaml_data(data: dict) -> ModbusSettings:
     modbus_settings = data["modbus_settings"]
-    return ModbusSettings(modbus_settings["host"], modbus_settings["port"])
+    return ModbusSettings(
+        modbus_settings["host"],
+        modbus_settings["port"],
+        modbus_settings.get("idle_timeout"),
+        modbus_settings.get("socket_rcvbuf"),
+        modbus_settings.get("socket_sndbuf"),
+    )
 
 
 def _mqtt_settings_from_yaml_data(data: dict) -> MqttSettings:
@@ -190,6 +202,9 @@ def _mqtt_settings_from_yaml_data(data: dict) -> MqttSettings:
         mqtt_settings["port"],
         mqtt_settings["command_topic"],
         mqtt_settings.get("error_topic"),
+        error_batch_window=mqtt_settings.get("error_batch_window") or 0.0,
+        socket_rcvbuf=mqtt_settings.get("socket_rcvbuf"),
+        socket_sndbuf=mqtt_settings.get("socket_sndbuf"),
     )
 
 
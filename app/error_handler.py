@@ -37,16 +37,23 @@ class ErrorHandler:
         self.port = mqtt_settings.port
         self.topic = mqtt_settings.error_topic
         if self.active:
-            logging.info(f"Configured to publish errors via MQTT under {self.topic}")
-        self._client = MqttWriter(self.host, self.port, mqtt_client)
+            logging.info("Configured to publish errors via MQTT under %s", self.topic)
+        self._client = MqttWriter(
+            self.host, self.port, mqtt_client, mqtt_settings.error_batch_window
+        )
+
+    def stop(self):
+        if self._client is not None:
+            self._client.stop()
 
     def publish(self, category: Category, message: str):
-        logging.error(f"{category}: {message}")
+        logging.error("%s: %s", category, message)
         if not self.active:
             return
         payload = ErrorMessage.write(
             {"category": category, "message": message, "timestamp": time.time()}
         )
         topic = f"{self.topic}/{category}"
-        logging.info(f"Publishing a {category} error to topic {topic}: {message}")
-        self._client.publish(topic, payload)
+        logging.info("Publishing a %s error to topic %s: %s", category, topic, message)
+        # Unexpected errors are rare and worth seeing straight away, so skip batching
+        self._client.publish(topic, payload, urgent=category == self.Category.UNHANDLED)
@@ -4,9 +4,9 @@ This module encapsulates the functionality required to read and validate an inco
 """
 
 import json
-from json import JSONDecodeError
 import logging
-from pydantic import validate_call, ValidationError
+import orjson
+from pydantic import TypeAdapter, ValidationError
 
 from app.exceptions import InvalidMessageError, UnknownCommandError
 from app.configuration import Configuration, InputTypes
@@ -16,12 +16,17 @@ class CommandMessageList:
     """Create a CommandMessage object and retrieve its configuration."""
 
     @classmethod
-    def read(cls, message_str: str):
+    def read(cls, message: bytes | str):
         try:
-            message_list = json.loads(message_str)
-        except JSONDecodeError as ex:
+            message_list = orjson.loads(message)
+        except orjson.JSONDecodeError as ex:
             raise InvalidMessageError(f"Message is invalid JSON syntax: {ex}")
 
+        if isinstance(message_list, dict):
+            message_list = [message_list]
+        elif not isinstance(message_list, list):
+            raise InvalidMessageError("Message must be a list of command objects")
+
         for message_obj in message_list:
             if not isinstance(message_obj, dict):
                 raise InvalidMessageError("Message object must be a dict")
@@ -31,6 +36,20 @@ class CommandMessageList:
                 )
         return message_list
 
+    @classmethod
+    def parse(cls, message: bytes | str, configuration: Configuration):
+        """Read a message and return its commands, validated and transformed."""
+        command_list = []
+        append = command_list.append
+        for message_obj in cls.read(message):
+            command = CommandMessage(
+                message_obj["action"], message_obj["value"], configuration
+            )
+            command.validate()
+            command.transform()
+            append(command)
+        return command_list
+
 
 class CommandMessage:
     """Create a CommandMessage object and retrieve its configuration."""
@@ -55,15 +74,21 @@ class CommandMessage:
             MessageValidator.validate(self.input_type, self.value)
 
 
+# Built once so the pydantic core validator isn't recreated for every message
+_BOOL_ADAPTER = TypeAdapter(bool)
+
+
 class MessageValidator:
     @classmethod
-    @validate_call
-    def is_bool(cls, value: bool) -> bool:
+    def is_bool(cls, value) -> bool:
+        _BOOL_ADAPTER.validate_python(value)
         return True
 
     @classmethod
     def validate(cls, input_type, value):
         if input_type == InputTypes.COIL:
+            if value is True or value is False:
+                return
             try:
                 cls.is_bool(value)
             except ValidationError:
@@ -85,7 +110,7 @@ class MessageTransformer:
         if configuration.invert_sign:
             value = -1 * value
         logging.debug(
-            f"transformed value {value} with config {configuration} to {tvalue}"
+            "transformed value %s with config %s to %s", tvalue, configuration, value
         )
         return value
 
@@ -98,5 +123,5 @@ class ErrorMessage:
         try:
             return json.dumps(message)
         except (TypeError, ValueError, OverflowError) as ex:
-            logging.error(f"Couldn't write message {message}")
+            logging.error("Couldn't write message %s", message)
             raise InvalidMessageError(f"JSON object cannot be serialised: {ex}")
@@ -5,31 +5,49 @@ The `ModbusClient` class encapsulates the functionality of the Modbus client, in
 to write coils and registers.
 
 Example:
-    Instantiate a `ModbusClient` object with a configuration and a Modbus TCP client:
+    Instantiate a `ModbusClient` object with a configuration, a Modbus TCP client and an
+    error handler:
 
     ```
     configuration = Configuration(...)
     modbus_client = ModbusTcpClient(...)
-    client = ModbusClient(configuration, modbus_client)
+    client = ModbusClient(configuration, modbus_client, error_handler)
 
-    client.write_coil("coil_name", True)
-    client.write_coils("coil_name", [True, False, True])
-    client.write_register("register_name", 123)
+    client.write_command(CommandMessage("coil_name", True, configuration))
+    client.write_command(CommandMessage("coil_name", [True, False, True], configuration))
+    client.write_command(CommandMessage("register_name", 123, configuration))
+    client.write_commands(
+        [
+            CommandMessage("coil_name", True, configuration),
+            CommandMessage("next_coil_name", False, configuration),
+        ]
+    )
+    client.write_coils_range(10, [True, False])
     ```
 
+    The TCP connection is opened on the first write and kept open for subsequent writes.
+    It is dropped after a failed write, and optionally after `idle_timeout` seconds without
+    a write, and re-established on the next write. Use the client as a context manager, or
+    call `close()`, to release the connection.
+
 Note:
     This module requires the `pymodbus` package to be installed.
 
 """
 
+import functools
 import logging
 import struct
+import threading
+import time
 
 from pymodbus.client import ModbusTcpClient
 from pymodbus.exceptions import ModbusException
-from app.configuration import Configuration, HoldingRegister, InputTypes
+from app.configuration import Coil, Configuration, HoldingRegister, InputTypes
+from app.memory_order import MemoryOrder
 from app.payload_builder import PayloadBuilder
-from app.exceptions import ModbusClientError, InvalidMessageError
+from app.socket_options import tune_socket
+from app.exceptions import ModbusClientError, InvalidMessageError, UnknownCommandError
 from app.error_handler import ErrorHandler
 
 
@@ -46,95 +64,239 @@ class ModbusClient:
         self._client = modbus_client
         self.error_handler = error_handler
 
-    def _write_coils(self, name: str, value: list[bool]):
-        coil_configuration = self.configuration.get_coil(name)
-        if coil_configuration:
-            try:
-                self._client.connect()
-                response = self._client.write_coils(
-                    coil_configuration.address[0], value
-                )
-                self._client.close()
-                if response.isError():
-                    raise ModbusClientError(response)
-                logging.debug(f"wrote to coil {name}, value: {value!r}")
-                return len(value)
-            except ModbusException as ex:
-                raise ModbusClientError(ex)
+        # The connection is kept open between writes; the lock serialises writes
+        # against the idle watchdog closing the socket underneath them.
+        self._lock = threading.Lock()
+        self._tuned_socket = None
+        self._last_write = time.monotonic()
+        self._closed = threading.Event()
+        modbus_settings = configuration.get_modbus_settings()
+        self._idle_timeout = modbus_settings.idle_timeout
+        self._socket_rcvbuf = modbus_settings.socket_rcvbuf
+        self._socket_sndbuf = modbus_settings.socket_sndbuf
+        if self._idle_timeout:
+            threading.Thread(target=self._close_when_idle, daemon=True).start()
+
+        self._dispatch = self._build_dispatch()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            self._client.close()
+
+    def _ensure_connected(self):
+        if not self._client.connected:
+            self._client.connect()
+        self._tune_socket()
 
-    def _write_coil(self, name: str, value: bool):
-        coil_configuration = self.configuration.get_coil(name)
-        if coil_configuration:
+    def _tune_socket(self):
+        # pymodbus closes the socket when a request fails and opens a new one by itself,
+        # so check for a new socket after every request rather than only on connect
+        sock = getattr(self._client, "socket", None)
+        if sock is None or sock is self._tuned_socket:
+            return
+        # Each request is a small frame which we wait on, so don't let Nagle delay it
+        tune_socket(sock, self._socket_rcvbuf, self._socket_sndbuf, nodelay=True)
+        self._tuned_socket = sock
+
+    def _close_when_idle(self):
+        timeout = self._idle_timeout
+        while not self._closed.wait(timeout):
+            with self._lock:
+                idle = time.monotonic() - self._last_write
+                if idle < self._idle_timeout:
+                    timeout = self._idle_timeout - idle
+                    continue
+                if self._client.connected:
+                    logging.debug("closing Modbus connection idle for %.1fs", idle)
+                    self._client.close()
+                timeout = self._idle_timeout
+
+    def _execute(self, request, *args):
+        with self._lock:
             try:
-                self._client.connect()
-                response = self._client.write_coil(
-                    coil_configuration.address[0], value, 1
-                )
-                self._client.close()
-                if response.isError():
-                    raise ModbusClientError(response)
-                logging.debug(f"wrote to coil {name}, value: {value!r}")
-                return 1
+                self._ensure_connected()
+                response = request(*args)
             except ModbusException as ex:
+                # Drop the connection so that the next write reconnects
+                self._client.close()
                 raise ModbusClientError(ex)
+            finally:
+                self._last_write = time.monotonic()
+            self._tune_socket()
+        if response.isError():
+            raise ModbusClientError(response)
+        return response
+
+    def _build_dispatch(self):
+        """Map each configured command name to the method which writes its value."""
+        dispatch = {}
+        for coil in self.configuration.get_coils():
+            dispatch[coil.name] = functools.partial(self._write_coil_command, coil)
+        for register in self.configuration.get_holding_registers():
+            dispatch[register.name] = functools.partial(self._write_register, register)
+        return dispatch
+
+    def _write_coil_command(self, coil: Coil, value):
+        if isinstance(value, list):
+            return self._write_coils(coil, value)
+        return self._write_coil(coil, bool(value))
+
+    def _write_coils(self, coil: Coil, value: list[bool]):
+        self._execute(self._client.write_coils, coil.address[0], value)
+        logging.debug("wrote to coil %s, value: %r", coil.name, value)
+        return len(value)
+
+    def _write_coil(self, coil: Coil, value: bool):
+        self._execute(self._client.write_coil, coil.address[0], value, 1)
+        logging.debug("wrote to coil %s, value: %r", coil.name, value)
+        return 1
+
+    def _write_register(self, register: HoldingRegister, value):
+        try:
+            payload = _build_register_payload(register, value)
+        except (AttributeError, RuntimeError, struct.error) as ex:
+            raise InvalidMessageError(ex)
+        self._execute(self._client.write_registers, register.address[0], payload, 1)
+        logging.debug("wrote to register %s, value: %r", register.name, value)
+        return 1
+
+    def write_coils_range(self, start_addr: int, values: list[bool]):
+        self._execute(self._client.write_coils, start_addr, values, 1)
+        logging.debug("wrote to coils from %s, values: %r", start_addr, values)
+        return len(values)
 
-    def _write_register(self, name: str, value):
-        holding_register_configuration = self.configuration.get_holding_register(name)
-        if holding_register_configuration:
+    def write_registers_range(self, start_addr: int, payload: list[int]):
+        self._execute(self._client.write_registers, start_addr, payload, 1)
+        logging.debug("wrote to registers from %s, payload: %r", start_addr, payload)
+        return len(payload)
+
+    def _build_run_payload(self, messages):
+        payload = []
+        for message in messages:
+            register = self.configuration.get_holding_register(message.name)
             try:
-                payload = _build_register_payload(holding_register_configuration, value)
+                words = _build_register_payload(register, message.value)
             except (AttributeError, RuntimeError, struct.error) as ex:
                 raise InvalidMessageError(ex)
-            try:
-                self._client.connect()
-                response = self._client.write_registers(
-                    holding_register_configuration.address[0], payload, 1
+            if len(words) != len(register.address):
+                # Packed together with its neighbours, this would overwrite the next register
+                raise InvalidMessageError(
+                    f"Payload for {register.name!r} does not match its address range"
                 )
-                self._client.close()
-                logging.debug(f"wrote to register {name}, value: {value!r}")
-                if response.isError():
-                    raise ModbusClientError(response)
-                return 1
-            except ModbusException as ex:
-                raise ModbusClientError(ex)
+            payload.extend(words)
+        first = self.configuration.get_holding_register(messages[0].name)
+        return first.address[0], payload
 
-    def write_command(self, message):
+    def _write_run(self, messages):
+        """Write a run of commands to contiguous addresses in a single request."""
+        first = messages[0]
+        try:
+            if first.input_type == InputTypes.COIL:
+                start_addr = self.configuration.get_coil(first.name).address[0]
+                self.write_coils_range(start_addr, [bool(m.value) for m in messages])
+            else:
+                start_addr, payload = self._build_run_payload(messages)
+                self.write_registers_range(start_addr, payload)
+        except InvalidMessageError:
+            # Fall back to writing one command at a time, which reports the bad command
+            return sum(self.write_command(message) for message in messages)
+        except ModbusClientError as ex:
+            self.error_handler.publish(
+                self.error_handler.Category.MODBUS_ERROR, str(ex)
+            )
+            return 0
+        return len(messages)
+
+    def write_commands(self, messages):
+        """Write commands in order, combining runs to contiguous addresses into one request."""
         sent = 0
+        for run in _group_adjacent(messages):
+            sent += self._write_run(run) if len(run) > 1 else self.write_command(run[0])
+        return sent
 
-        name = message.name
-        value = message.value
-        if message.input_type == InputTypes.COIL:
-            try:
-                if isinstance(value, list):
-                    sent += self._write_coils(name, value)
-                else:
-                    sent += self._write_coil(name, bool(value))
-            except ModbusClientError as ex:
-                self.error_handler.publish(
-                    self.error_handler.Category.MODBUS_ERROR, str(ex)
-                )
-                return 0
+    def write_command(self, message):
+        write = self._dispatch.get(message.name)
+        try:
+            if write is None:
+                raise UnknownCommandError(message.name)
+            return write(message.value)
+        except UnknownCommandError as ex:
+            self.error_handler.publish(
+                self.error_handler.Category.UNKNOWN_COMMAND, str(ex)
+            )
+        except InvalidMessageError as ex:
+            self.error_handler.publish(
+                self.error_handler.Category.INVALID_MESSAGE, str(ex)
+            )
+        except ModbusClientError as ex:
+            self.error_handler.publish(
+                self.error_handler.Category.MODBUS_ERROR, str(ex)
+            )
+        return 0
 
-        if message.input_type == InputTypes.REGISTER:
-            try:
-                sent += self._write_register(name, value)
-            except InvalidMessageError as ex:
-                self.error_handler.publish(
-                    self.error_handler.Category.INVALID_MESSAGE, str(ex)
-                )
-                return 0
-            except ModbusClientError as ex:
-                self.error_handler.publish(
-                    self.error_handler.Category.MODBUS_ERROR, str(ex)
-                )
-                return 0
 
-        return sent
+def _address_span(message):
+    """Return the first address written by a command and the address following it."""
+    address = message.configuration.address
+    if message.input_type == InputTypes.COIL:
+        return address[0], address[0] + 1
+    return address[0], address[0] + len(address)
+
+
+def _group_adjacent(messages):
+    """Split commands into runs which can each be written in one request.
+
+    A command joins the run before it when it is of the same type and its address follows
+    on from the previous command's. Commands are never reordered, so repeated writes to
+    the same address still take effect in the order they were received. Coil commands
+    with a list of values are always written on their own.
+    """
+    runs = []
+    previous_end = None
+    previous_type = None
+    for message in messages:
+        if isinstance(message.value, list):
+            runs.append([message])
+            previous_end = None
+            continue
+        start, end = _address_span(message)
+        if message.input_type == previous_type and start == previous_end:
+            runs[-1].append(message)
+        else:
+            runs.append([message])
+        previous_end = end
+        previous_type = message.input_type
+    return runs
 
 
 def _build_register_payload(holding_register: HoldingRegister, value):
+    try:
+        payload = _build_payload_cached(
+            holding_register.data_type, value, holding_register.memory_order
+        )
+    except TypeError:
+        # Unhashable values can't be cached, so build them directly
+        payload = _build_payload(
+            holding_register.data_type, value, holding_register.memory_order
+        )
+    return list(payload)
+
+
+def _build_payload(data_type: str, value, memory_order: MemoryOrder):
     payload_builder = PayloadBuilder()
-    payload_builder.set_data_type(holding_register.data_type)
+    payload_builder.set_data_type(data_type)
     payload_builder.set_value(value)
-    payload_builder.set_memory_order(holding_register.memory_order)
-    return payload_builder.build()
+    payload_builder.set_memory_order(memory_order)
+    return tuple(payload_builder.build())
+
+
+# Commands tend to repeat a small set of values for each register, so keep the encoded
+# payloads. typed=True keeps e.g. 1 and 1.0 apart, as they don't encode the same way.
+_build_payload_cached = functools.lru_cache(maxsize=1024, typed=True)(_build_payload)
@@ -5,6 +5,9 @@ This module provides a client class for subscribing to topics and receiving mess
 """
 
 import logging
+import queue
+import threading
+from collections import Counter
 from typing import Callable
 
 import paho.mqtt.client as mqtt
@@ -13,10 +16,25 @@ from app.message import CommandMessage, CommandMessageList
 from app.configuration import Configuration
 from app.exceptions import InvalidMessageError, UnknownCommandError
 from app.error_handler import ErrorHandler
+from app.socket_options import tune_socket
 
+# Messages waiting for the worker beyond this are dropped rather than stalling the network loop
+COMMAND_QUEUE_SIZE = 1024
 
-def _decode_message(message):
-    return message.payload.decode()
+
+def _make_dispatch(callbacks):
+    """Return a function which passes a message to each of the callbacks, if there are any."""
+    callbacks = tuple(callbacks)
+    if not callbacks:
+        return None
+    if len(callbacks) == 1:
+        return callbacks[0]
+
+    def dispatch(msg_obj):
+        for callback in callbacks:
+            callback(msg_obj)
+
+    return dispatch
 
 
 class MqttReader:
@@ -29,14 +47,39 @@ class MqttReader:
         self.configuration = configuration
         self.error_handler = error_handler
         self._on_message_callbacks = []
+        self._dispatch = _make_dispatch(self._on_message_callbacks)
+        self._on_message_list_callbacks = []
         self._client = client
 
-        self._host = configuration.get_mqtt_settings().host
-        self._port = configuration.get_mqtt_settings().port
-        self._topics = [configuration.mqtt_settings.command_topic]
+        mqtt_settings = configuration.get_mqtt_settings()
+        self._host = mqtt_settings.host
+        self._port = mqtt_settings.port
+        self._topics = [mqtt_settings.command_topic]
+        # Subscribed to in a single SUBSCRIBE packet on every (re)connect
+        self._subscriptions = [(topic, 0) for topic in self._topics]
+        self._socket_rcvbuf = mqtt_settings.socket_rcvbuf
+        self._socket_sndbuf = mqtt_settings.socket_sndbuf
+
+        self._work_q = queue.Queue(maxsize=COMMAND_QUEUE_SIZE)
+        # Messages dropped because the queue was full, by topic, for the worker to report
+        self._dropped = Counter()
+        self._dropped_lock = threading.Lock()
+        self._worker = None
+        self._network_loop = None
+        self._network_loop_error = None
+        self._stopped = threading.Event()
+
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_message = self._on_message
 
     def add_message_callback(self, f: Callable[[str], None]):
         self._on_message_callbacks.append(f)
+        self._dispatch = _make_dispatch(self._on_message_callbacks)
+
+    def add_message_list_callback(self, f: Callable[[list[CommandMessage]], None]):
+        """Register a callback which receives all the commands from a payload at once."""
+        self._on_message_list_callbacks.append(f)
 
     def connect(self) -> None:
         try:
@@ -48,78 +91,148 @@ class MqttReader:
 
     def stop(self) -> None:
         self._client.disconnect()
+        if self._network_loop is not None:
+            self._network_loop.join()
+            self._network_loop = None
+        if self._worker is not None:
+            self._work_q.put(None)
+            self._worker.join()
+            self._worker = None
+        self._stopped.set()
+
+    def start(self) -> None:
+        """Start the MQTT client without blocking.
+
+        The network loop runs in a background thread, and received messages are put on a
+        bounded queue for a worker thread so that Modbus writes don't hold up the network
+        loop. A single worker is used so that commands are written in the order they were
+        received.
+        """
+        self.connect()
+
+        self._stopped.clear()
+        self._network_loop_error = None
+        self._worker = threading.Thread(
+            target=self._work, name="command-worker", daemon=True
+        )
+        self._worker.start()
+        self._network_loop = threading.Thread(
+            target=self._run_network_loop, name="mqtt-network-loop", daemon=True
+        )
+        self._network_loop.start()
+        logging.info("Service started")
 
     def run(self) -> None:
         """Run the MQTT client.
 
-        This method blocks the execution and keeps the client connected to the MQTT broker.
+        This method blocks the execution and keeps the client connected to the MQTT broker
+        until `stop` is called. If the network loop fails, its exception is raised here
+        so that the service exits rather than carrying on without receiving commands.
         """
-        self._client.on_connect = self._on_connect()
-        self._client.on_disconnect = self._on_disconnect()
-        self._client.on_message = self._on_message()
-
-        self.connect()
+        self.start()
+        self._stopped.wait()
+        if self._network_loop_error is not None:
+            raise self._network_loop_error
 
-        logging.info("Service started")
-        self._client.loop_forever()
+    def _run_network_loop(self):
+        # paho's loop_start() thread would end silently on an error, leaving run() waiting
+        try:
+            self._client.loop_forever(retry_first_connection=True)
+        except Exception as ex:
+            logging.error("MQTT network loop failed: %s", ex)
+            self._network_loop_error = ex
+        finally:
+            self._stopped.set()
+
+    def _on_message(self, _client, _userdata, message):
+        try:
+            self._work_q.put_nowait(message)
+        except queue.Full:
+            # Reporting the drop can block on connecting to the broker, so leave it to the
+            # worker rather than holding up, or failing, the network loop
+            logging.warning(
+                "Command queue is full, dropped message on topic %s", message.topic
+            )
+            with self._dropped_lock:
+                self._dropped[message.topic] += 1
+
+    def _report_dropped(self):
+        with self._dropped_lock:
+            dropped = self._dropped
+            self._dropped = Counter()
+        for topic, count in dropped.items():
+            try:
+                self.error_handler.publish(
+                    self.error_handler.Category.MQTT_ERROR,
+                    f"Command queue is full, dropped {count} message(s) on topic {topic}",
+                )
+            # Don't let a failed report stop the message in hand from being processed
+            except Exception:
+                logging.exception(
+                    "Failed to report dropped messages on topic %s", topic
+                )
 
-    def _on_message(self):
-        def inner(_client, _userdata, message):
-            msg_topic = message.topic
-            msg_str = ""
-            msg_obj_list = []
+    def _work(self):
+        while True:
+            message = self._work_q.get()
             try:
-                try:
-                    msg_str = _decode_message(message)
-                    msg_list = CommandMessageList.read(msg_str)
-                    for msg_dict in msg_list:
-                        msg_obj = CommandMessage(
-                            msg_dict["action"], msg_dict["value"], self.configuration
-                        )
-                        msg_obj.validate()
-                        msg_obj.transform()
-                        msg_obj_list.append(msg_obj)
-                except InvalidMessageError as ex:
-                    self.error_handler.publish(
-                        self.error_handler.Category.INVALID_MESSAGE, str(ex)
-                    )
-                    return
-                except UnknownCommandError as ex:
-                    self.error_handler.publish(
-                        self.error_handler.Category.UNKNOWN_COMMAND, str(ex)
-                    )
+                if message is None:
                     return
+                if self._dropped:
+                    self._report_dropped()
+                self._process_message(message)
+            # Reporting an error can fail too, e.g. when the broker can't be reached, so
+            # log it here rather than let one message stop the worker for good
+            except Exception:
+                logging.exception(
+                    "Failed to process message on topic %s", message.topic
+                )
+            finally:
+                self._work_q.task_done()
+
+    def _process_message(self, message):
+        msg_topic = message.topic
+        payload_bytes = message.payload
+        error_handler = self.error_handler
+        dispatch = self._dispatch
+        try:
+            try:
+                msg_obj_list = CommandMessageList.parse(
+                    payload_bytes, self.configuration
+                )
+            except InvalidMessageError as ex:
+                error_handler.publish(error_handler.Category.INVALID_MESSAGE, str(ex))
+                return
+            except UnknownCommandError as ex:
+                error_handler.publish(error_handler.Category.UNKNOWN_COMMAND, str(ex))
+                return
+            if dispatch is not None:
                 for msg_obj in msg_obj_list:
-                    for callback in self._on_message_callbacks:
-                        callback(msg_obj)
-            # In general it's not good practice to catch Exception, but we're doing so here
-            # in order to trap unhandled exceptions occurring within message processing,
-            # and prevent them rising up to the main loop.
-            # If these occur, the cause should be identified and code changed to catch them.
-            except Exception as ex:
-                logging.error(f"Encountered error {ex} on topic {msg_topic}")
-                logging.info(msg_str)
-                self.error_handler.publish(
-                    self.error_handler.Category.UNHANDLED, str(ex)
+                    dispatch(msg_obj)
+            for callback in self._on_message_list_callbacks:
+                callback(msg_obj_list)
+        # In general it's not good practice to catch Exception, but we're doing so here
+        # in order to trap unhandled exceptions occurring within message processing,
+        # and prevent them from being silently discarded by the worker.
+        # If these occur, the cause should be identified and code changed to catch them.
+        except Exception as ex:
+            logging.error("Encountered error %s on topic %s", ex, msg_topic)
+            logging.info("%s", payload_bytes.decode("utf-8", errors="replace"))
+            error_handler.publish(error_handler.Category.UNHANDLED, str(ex))
+
+    def _on_connect(self, client, _userdata, _flags, reason_code, _properties):
+        if reason_code == 0:
+            logging.info("Connected to MQTT broker")
+            sock = client.socket()
+            if sock is not None:
+                tune_socket(
+                    sock, self._socket_rcvbuf, self._socket_sndbuf, nodelay=True
                 )
-
-        return inner
-
-    def _on_connect(self):
-        def inner(client, _userdata, _flags, reason_code, _properties):
-            if reason_code == 0:
-                logging.info("Connected to MQTT broker")
-                for topic in self._topics:
-                    logging.info("Subscribing to topic: %s", topic)
-                    client.subscribe(topic)
-            else:
-                logging.error(f"Problem connecting to MQTT broker: {reason_code}")
-
-        return inner
-
-    def _on_disconnect(self):
-        def inner(client, _userdata, reason_code, _properties):
-            if reason_code > 0:
-                logging.error(f"MQTT client has disconnected: {reason_code}")
-
-        return inner
+            logging.info("Subscribing to topics: %s", ", ".join(self._topics))
+            client.subscribe(self._subscriptions)
+        else:
+            logging.error("Problem connecting to MQTT broker: %s", reason_code)
+
+    def _on_disconnect(self, _client, _userdata, _flags, reason_code, _properties):
+        if reason_code > 0:
+            logging.error("MQTT client has disconnected: %s", reason_code)
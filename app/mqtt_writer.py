@@ -2,9 +2,19 @@
 
 This module provides a client class for publishing messages to MQTT brokers.
 
+The connection is made on the first publish and then kept open, with paho's background
+network loop reconnecting to the broker if the connection drops.
+
+If a batch window is set, messages published to the same topic within that window are
+sent together as a single JSON array, rather than as one MQTT message each. A message
+that arrives on its own is sent unchanged. Call `stop()` on shutdown so that messages
+still waiting for the window to close are sent.
+
 """
 
 import logging
+import threading
+from collections import defaultdict, deque
 
 import paho.mqtt.client as mqtt
 
@@ -12,23 +22,86 @@ import paho.mqtt.client as mqtt
 class MqttWriter:
     _client: mqtt.Client
 
-    def __init__(self, host: str, port: int, client: mqtt.Client) -> None:
+    def __init__(
+        self, host: str, port: int, client: mqtt.Client, batch_window: float = 0.0
+    ) -> None:
         self.host = host
         self.port = port
         self._client = client
+        self._started = False
+        # Publishes can come from paho's network thread as well as the command worker
+        self._connect_lock = threading.Lock()
+
+        self.batch_window = batch_window
+        self._buffers = defaultdict(deque)
+        self._buffer_lock = threading.Lock()
+        self._flush_timer = None
+
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
 
     def connect(self) -> None:
         try:
             self._client.connect(self.host, self.port)
-            return True
         except OSError as e:
             ex = OSError(f"Cannot connect to MQTT broker at {self.host}:{self.port}")
             raise ex from e
+        self._client.loop_start()
+        self._started = True
+        return True
+
+    def stop(self) -> None:
+        """Send any batched messages and close the connection."""
+        with self._buffer_lock:
+            flush_timer = self._flush_timer
+        if flush_timer is not None:
+            flush_timer.cancel()
+        self.flush()
+        with self._connect_lock:
+            if self._started:
+                self._client.disconnect()
+                self._client.loop_stop()
+                self._started = False
+
+    def publish(self, topic: str, payload: str, urgent: bool = False):
+        if not self._started:
+            with self._connect_lock:
+                if not self._started:
+                    self.connect()
+        if urgent or self.batch_window <= 0:
+            self._send(topic, payload)
+            return
+
+        with self._buffer_lock:
+            self._buffers[topic].append(payload)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.batch_window, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        with self._buffer_lock:
+            buffers = self._buffers
+            self._buffers = defaultdict(deque)
+            self._flush_timer = None
+
+        for topic, payloads in buffers.items():
+            if len(payloads) == 1:
+                self._send(topic, payloads[0])
+            else:
+                self._send(topic, "[" + ",".join(payloads) + "]")
+
+    def _send(self, topic: str, payload: str):
+        response = self._client.publish(topic, payload, qos=1)
+        if response[0] == 0:
+            logging.debug("Published message successfully with id %s", response[1])
+            return
+        logging.error("Failed to publish to %s: %s", topic, payload)
+
+    def _on_connect(self, _client, _userdata, _flags, reason_code, _properties):
+        if reason_code != 0:
+            logging.error("Problem connecting to MQTT broker: %s", reason_code)
 
-    def publish(self, topic: str, payload: str):
-        if self.connect():
-            response = self._client.publish(topic, payload, qos=1)
-            if response[0] == 0:
-                logging.debug(f"Published message successfully with id {response[1]}")
-                return
-        logging.error(f"Failed to publish to {topic}: {payload}")
+    def _on_disconnect(self, _client, _userdata, _flags, reason_code, _properties):
+        if reason_code > 0:
+            logging.error("MQTT client has disconnected: %s", reason_code)
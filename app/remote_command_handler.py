@@ -1,4 +1,5 @@
-from app.configuration import Configuration, MqttSettings, ModbusSettings
+from dataclasses import replace
+from app.configuration import Configuration
 import argparse
 
 
@@ -49,16 +50,18 @@ class RemoteCommandHandler:
         mqtt_settings = configuration.get_mqtt_settings()
         modbus_settings = configuration.get_modbus_settings()
 
-        mqtt_settings_with_override = MqttSettings(
-            args_as_dict.get("mqtt_host") or mqtt_settings.host,
-            args_as_dict.get("mqtt_port") or mqtt_settings.port,
-            args_as_dict.get("mqtt_command_topic") or mqtt_settings.command_topic,
-            mqtt_settings.error_topic,
+        command_topic = args_as_dict.get("mqtt_command_topic")
+        mqtt_settings_with_override = replace(
+            mqtt_settings,
+            host=args_as_dict.get("mqtt_host") or mqtt_settings.host,
+            port=args_as_dict.get("mqtt_port") or mqtt_settings.port,
+            command_topic=command_topic or mqtt_settings.command_topic,
         )
 
-        modbus_settings_with_override = ModbusSettings(
-            args_as_dict.get("modbus_host") or modbus_settings.host,
-            args_as_dict.get("modbus_port") or modbus_settings.port,
+        modbus_settings_with_override = replace(
+            modbus_settings,
+            host=args_as_dict.get("modbus_host") or modbus_settings.host,
+            port=args_as_dict.get("modbus_port") or modbus_settings.port,
         )
 
         return Configuration(
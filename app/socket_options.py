@@ -0,0 +1,21 @@
+"""Socket options module.
+
+This module provides a helper for tuning the sockets used to talk to the MQTT broker and
+the Modbus server once they are connected.
+
+"""
+
+import socket
+
+
+def tune_socket(sock, rcvbuf: int = None, sndbuf: int = None, nodelay: bool = False):
+    """Apply buffer sizes and TCP_NODELAY to a connected socket.
+
+    Buffer sizes which aren't set are left at the operating system default.
+    """
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -19,6 +19,7 @@ Note:
 
 """
 
+import atexit
 import logging
 import os
 
@@ -45,12 +46,10 @@ def setup_error_handler(configuration: Configuration) -> ErrorHandler:
 def setup_modbus_client(
     configuration: Configuration, error_handler: ErrorHandler
 ) -> ModbusClient:
+    modbus_settings = configuration.get_modbus_settings()
     return ModbusClient(
         configuration,
-        ModbusTcpClient(
-            configuration.get_modbus_settings().host,
-            port=configuration.get_modbus_settings().port,
-        ),
+        ModbusTcpClient(modbus_settings.host, port=modbus_settings.port),
         error_handler,
     )
 
@@ -83,21 +82,26 @@ def main():
         logging.error("Error retrieving configuration, exiting")
         sys.exit(1)
 
+    site_settings = configuration.get_site_settings()
     logging.info(
-        f"Starting service at {configuration.get_site_settings().site_name}"
-        f"/{configuration.get_site_settings().serial_number}"
+        "Starting service at %s/%s",
+        site_settings.site_name,
+        site_settings.serial_number,
     )
     error_handler = setup_error_handler(configuration)
+    # Registered first so that it runs last, once nothing else will report errors
+    atexit.register(error_handler.stop)
     modbus_client = setup_modbus_client(configuration, error_handler)
+    atexit.register(modbus_client.close)
     mqtt_reader = setup_mqtt_client(configuration, error_handler)
 
-    def write_to_modbus(message):
-        modbus_client.write_command(message)
+    def write_to_modbus(messages):
+        modbus_client.write_commands(messages)
 
-    mqtt_reader.add_message_callback(write_to_modbus)
+    mqtt_reader.add_message_list_callback(write_to_modbus)
 
     def signal_handler(signum, _):
-        logging.info(f"Received signal {signum}, shutting down...")
+        logging.info("Received signal %s, shutting down...", signum)
         mqtt_reader.stop()
         sys.exit(0)
 
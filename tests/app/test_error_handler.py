@@ -46,3 +46,12 @@ def test_error_payload():
         payload = call_args[1]
         assert '"timestamp": 1688212800.0' in payload
         assert '"message": "oops"' in payload
+
+
+def test_stop_error_handler():
+    mock_mqtt_client = MagicMock(spec=mqtt.Client)
+    config = Configuration.from_file(example_config_path())
+    error = ErrorHandler(config, mock_mqtt_client)
+    error.publish(error.Category.UNKNOWN_COMMAND, "oops")
+    error.stop()
+    mock_mqtt_client.loop_stop.assert_called_once()
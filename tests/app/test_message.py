@@ -35,6 +35,44 @@ class TestCommandMessage:
         assert read_msgs[1].get("action") == "someregister"
         assert read_msgs[1].get("value") == 42.3
 
+    def test_bytes_cmd_message(self):
+        json_bytes = json.dumps([{"action": "somecoil", "value": True}]).encode()
+        read_msg = CommandMessageList.read(json_bytes)
+        assert read_msg == [{"action": "somecoil", "value": True}]
+
+    def test_single_cmd_message(self):
+        json_str = json.dumps({"action": "somecoil", "value": False})
+        read_msg = CommandMessageList.read(json_str)
+        assert read_msg == [{"action": "somecoil", "value": False}]
+
+    def test_bad_cmd_message_type(self):
+        with pytest.raises(InvalidMessageError) as ex:
+            CommandMessageList.read("42")
+        assert "Message must be a list of command objects" in str(ex.value)
+
+    def test_parse_cmd_messages(self):
+        json_bytes = json.dumps(
+            [
+                {"action": "evgBatteryModeCoil", "value": True},
+                {"action": "evgBatteryTargetPowerWatts", "value": 2000},
+            ]
+        ).encode()
+        commands = CommandMessageList.parse(json_bytes, self.configuration)
+        assert [c.name for c in commands] == [
+            "evgBatteryModeCoil",
+            "evgBatteryTargetPowerWatts",
+        ]
+        assert commands[0].value is True
+        assert commands[1].value == 20000
+
+        bad_value = json.dumps([{"action": "evgBatteryModeCoil", "value": "foo"}])
+        with pytest.raises(InvalidMessageError):
+            CommandMessageList.parse(bad_value, self.configuration)
+
+        unknown = json.dumps([{"action": "noSuchCoil", "value": True}])
+        with pytest.raises(UnknownCommandError):
+            CommandMessageList.parse(unknown, self.configuration)
+
     def test_unknown_command(self):
         with pytest.raises(UnknownCommandError) as ex:
             CommandMessage("bad_register", 54, self.configuration)
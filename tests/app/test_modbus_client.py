@@ -1,11 +1,18 @@
 """Unit tests for the ModbusClient class in the app.modbus_client module."""
 
-from unittest.mock import MagicMock
+import socket
+import struct
+import time
+from unittest.mock import MagicMock, call
 from pymodbus.client import ModbusTcpClient
 from pymodbus.exceptions import ModbusException
 from app.memory_order import MemoryOrder
 from app.message import CommandMessage
-from app.modbus_client import ModbusClient
+from app.modbus_client import (
+    ModbusClient,
+    _build_payload_cached,
+    _build_register_payload,
+)
 from app.configuration import (
     Coil,
     Configuration,
@@ -43,6 +50,9 @@ class TestModbusClient:
         self.site_settings = SiteSettings("localhost", "DEV123")
         self.modbus_settings = ModbusSettings("localhost", 5020)
         self.mock_client = MagicMock(spec=ModbusTcpClient)
+        self.mock_client.connected = False
+        self.mock_client.connect.side_effect = self._connect
+        self.mock_client.close.side_effect = self._close
         self.mock_client.write_coil.return_value = MockGoodModbusResponse()
         self.mock_client.write_coils.return_value = MockGoodModbusResponse()
         self.mock_client.write_registers.return_value = MockGoodModbusResponse()
@@ -62,6 +72,13 @@ class TestModbusClient:
             self.mock_error_handler,
         )
 
+    def _connect(self):
+        self.mock_client.connected = True
+        return True
+
+    def _close(self):
+        self.mock_client.connected = False
+
     @pytest.mark.parametrize("coil_value", [False, True])
     def test_coils(self, coil_value):
         coil_list = [coil_value] * 2
@@ -109,16 +126,16 @@ class TestModbusClient:
         self.mock_client.connect.side_effect = ModbusException("could not connect")
         test_coil = self.coils[0]
         with pytest.raises(ModbusClientError) as ex:
-            self.modbus_client._write_coil(test_coil.name, True)
+            self.modbus_client._write_coil(test_coil, True)
         assert "could not connect" in str(ex.value)
 
         with pytest.raises(ModbusClientError) as ex:
-            self.modbus_client._write_coils(test_coil.name, [True, False])
+            self.modbus_client._write_coils(test_coil, [True, False])
         assert "could not connect" in str(ex.value)
 
         test_register = self.holding_registers[0]
         with pytest.raises(ModbusClientError) as ex:
-            self.modbus_client._write_register(test_register.name, 0)
+            self.modbus_client._write_register(test_register, 0)
         assert "could not connect" in str(ex.value)
 
         self.modbus_client.write_command(
@@ -181,3 +198,233 @@ class TestModbusClient:
         self.mock_error_handler.publish.assert_called_with(
             self.mock_error_handler.Category.MODBUS_ERROR, "bad response"
         )
+
+    def test_connection_is_reused(self):
+        test_coil = self.coils[0]
+        for _ in range(3):
+            self.modbus_client.write_command(
+                CommandMessage(test_coil.name, True, self.configuration)
+            )
+        assert self.mock_client.connect.call_count == 1
+        self.mock_client.close.assert_not_called()
+
+    def test_reconnect_after_failure(self):
+        test_coil = self.coils[0]
+        assert self.modbus_client._write_coil(test_coil, True) == 1
+        self.mock_client.write_coil.side_effect = ModbusException("connection lost")
+        with pytest.raises(ModbusClientError):
+            self.modbus_client._write_coil(test_coil, True)
+        self.mock_client.close.assert_called_once()
+        assert self.mock_client.connect.call_count == 1
+
+        self.mock_client.write_coil.side_effect = None
+        assert self.modbus_client._write_coil(test_coil, True) == 1
+        assert self.mock_client.connect.call_count == 2
+
+    def test_failed_connect_is_retried(self):
+        self.mock_client.connect.side_effect = None
+        self.mock_client.connect.return_value = False
+        test_coil = self.coils[0]
+        self.modbus_client._write_coil(test_coil, True)
+        self.modbus_client._write_coil(test_coil, True)
+        assert self.mock_client.connect.call_count == 2
+
+    def test_context_manager_closes(self):
+        with ModbusClient(
+            self.configuration, self.mock_client, self.mock_error_handler
+        ) as modbus_client:
+            modbus_client._write_coil(self.coils[0], True)
+            self.mock_client.close.assert_not_called()
+        self.mock_client.close.assert_called_once()
+
+    def test_idle_timeout(self):
+        configuration = Configuration(
+            self.coils,
+            self.holding_registers,
+            {},
+            ModbusSettings("localhost", 5020, idle_timeout=0.05),
+            self.site_settings,
+        )
+        with ModbusClient(
+            configuration, self.mock_client, self.mock_error_handler
+        ) as modbus_client:
+            modbus_client._write_coil(self.coils[0], True)
+            time.sleep(0.2)
+            self.mock_client.close.assert_called_once()
+            modbus_client._write_coil(self.coils[0], True)
+            assert self.mock_client.connect.call_count == 2
+
+    def test_write_run(self):
+        coils = [Coil("first_coil", [10]), Coil("second_coil", [11])]
+        registers = [
+            HoldingRegister("int_register", MemoryOrder("AB"), "INT16", 1.0, [1]),
+            HoldingRegister("int32_register", MemoryOrder("AB"), "INT32", 1.0, [2, 3]),
+        ]
+        configuration = Configuration(
+            coils, registers, {}, self.modbus_settings, self.site_settings
+        )
+        modbus_client = ModbusClient(
+            configuration, self.mock_client, self.mock_error_handler
+        )
+
+        sent = modbus_client.write_commands(
+            [CommandMessage(c.name, True, configuration) for c in coils]
+        )
+        assert sent == 2
+        self.mock_client.write_coils.assert_called_once_with(10, [True, True], 1)
+        self.mock_client.write_coil.assert_not_called()
+
+        sent = modbus_client.write_commands(
+            [CommandMessage(r.name, 7, configuration) for r in registers]
+        )
+        assert sent == 2
+        self.mock_client.write_registers.assert_called_once_with(1, [7, 0, 7], 1)
+
+    def test_write_commands_keeps_order(self):
+        coils = [Coil("first_coil", [10]), Coil("second_coil", [11])]
+        registers = [
+            HoldingRegister("int_register", MemoryOrder("AB"), "INT16", 1.0, [1]),
+            HoldingRegister("next_register", MemoryOrder("AB"), "INT16", 1.0, [2]),
+        ]
+        configuration = Configuration(
+            coils, registers, {}, self.modbus_settings, self.site_settings
+        )
+        modbus_client = ModbusClient(
+            configuration, self.mock_client, self.mock_error_handler
+        )
+
+        def command(name, value):
+            return CommandMessage(name, value, configuration)
+
+        # Repeated writes to the same coil are applied in the order received
+        sent = modbus_client.write_commands(
+            [
+                command("second_coil", True),
+                command("first_coil", True),
+                command("first_coil", False),
+            ]
+        )
+        assert sent == 3
+        assert self.mock_client.write_coil.call_args_list == [
+            call(11, True, 1),
+            call(10, True, 1),
+            call(10, False, 1),
+        ]
+        self.mock_client.write_coils.assert_not_called()
+
+        # Only neighbouring commands are combined, and a run ends at a different type
+        self.mock_client.reset_mock()
+        sent = modbus_client.write_commands(
+            [
+                command("int_register", 1),
+                command("next_register", 2),
+                command("first_coil", True),
+                command("int_register", 3),
+                command("second_coil", False),
+            ]
+        )
+        assert sent == 5
+        assert self.mock_client.method_calls == [
+            call.write_registers(1, [1, 2], 1),
+            call.write_coil(10, True, 1),
+            call.write_registers(1, [3], 1),
+            call.write_coil(11, False, 1),
+        ]
+
+    def test_write_run_falls_back_on_size_mismatch(self):
+        # float_register is configured with a single address but needs two
+        registers = [
+            HoldingRegister("float_register", MemoryOrder("AB"), "FLOAT32", 1.0, [1]),
+            HoldingRegister("int_register", MemoryOrder("AB"), "INT16", 1.0, [2]),
+        ]
+        configuration = Configuration(
+            self.coils, registers, {}, self.modbus_settings, self.site_settings
+        )
+        modbus_client = ModbusClient(
+            configuration, self.mock_client, self.mock_error_handler
+        )
+        sent = modbus_client.write_commands(
+            [CommandMessage(r.name, 1, configuration) for r in registers]
+        )
+        assert sent == 2
+        assert self.mock_client.write_registers.call_count == 2
+
+    def test_write_run_failure(self):
+        self.mock_client.write_coils.return_value = MockBadModbusResponse()
+        coils = [Coil("first_coil", [10]), Coil("second_coil", [11])]
+        configuration = Configuration(
+            coils, [], {}, self.modbus_settings, self.site_settings
+        )
+        modbus_client = ModbusClient(
+            configuration, self.mock_client, self.mock_error_handler
+        )
+        sent = modbus_client.write_commands(
+            [CommandMessage(c.name, False, configuration) for c in coils]
+        )
+        assert sent == 0
+        self.mock_error_handler.publish.assert_called_with(
+            self.mock_error_handler.Category.MODBUS_ERROR, "bad response"
+        )
+
+    def test_register_payload_cache(self):
+        register = self.holding_registers[0]
+        _build_payload_cached.cache_clear()
+        assert _build_register_payload(register, 10) == [10]
+        assert _build_register_payload(register, 10) == [10]
+        assert _build_payload_cached.cache_info().hits == 1
+
+        # Equal values of a different type are not served from the cache
+        with pytest.raises(struct.error):
+            _build_register_payload(register, 10.0)
+
+        # Callers get their own copy of the cached payload
+        payload = _build_register_payload(register, 10)
+        payload.append(0)
+        assert _build_register_payload(register, 10) == [10]
+
+    def test_nodelay_on_connect(self):
+        self.mock_client.socket = MagicMock(spec=socket.socket)
+        self.modbus_client._write_coil(self.coils[0], True)
+        self.mock_client.socket.setsockopt.assert_called_once_with(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+
+    def test_nodelay_after_reconnect_in_pymodbus(self):
+        # pymodbus drops the socket on a failed request and returns an error response,
+        # then opens a new socket without going through ModbusClient
+        old_socket = MagicMock(spec=socket.socket)
+        new_socket = MagicMock(spec=socket.socket)
+        self.mock_client.socket = old_socket
+
+        def reconnect(*_args):
+            self.mock_client.socket = new_socket
+            return MockBadModbusResponse()
+
+        self.mock_client.write_coil.side_effect = reconnect
+        with pytest.raises(ModbusClientError):
+            self.modbus_client._write_coil(self.coils[0], True)
+        old_socket.setsockopt.assert_called_once()
+        new_socket.setsockopt.assert_called_once_with(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+
+        self.mock_client.write_coil.side_effect = None
+        self.modbus_client._write_coil(self.coils[0], True)
+        new_socket.setsockopt.assert_called_once()
+
+    def test_unknown_command(self):
+        configuration = Configuration(
+            [], self.holding_registers, {}, self.modbus_settings, self.site_settings
+        )
+        modbus_client = ModbusClient(
+            configuration, self.mock_client, self.mock_error_handler
+        )
+        sent = modbus_client.write_command(
+            CommandMessage(self.coils[0].name, True, self.configuration)
+        )
+        assert sent == 0
+        self.mock_error_handler.publish.assert_called_with(
+            self.mock_error_handler.Category.UNKNOWN_COMMAND,
+            "No coil or register found to match 'test_coil'",
+        )
+        self.mock_client.write_coil.assert_not_called()
@@ -9,11 +9,21 @@ from app.error_handler import ErrorHandler
 from app.configuration import Configuration
 import pytest
 import json
+import logging
+import queue
+import socket
+import threading
 
 
 class TestMqttReader:
     def setup_method(self):
         self.mock_mqtt_client = MagicMock(spec=mqtt.Client)
+        # Like paho's, the network loop runs until the client disconnects
+        disconnected = threading.Event()
+        self.mock_mqtt_client.disconnect.side_effect = lambda *_args: disconnected.set()
+        self.mock_mqtt_client.loop_forever.side_effect = (
+            lambda **_kwargs: disconnected.wait()
+        )
         self.mock_error_handler = MagicMock(spec=ErrorHandler)
         self.configuration = Configuration.from_file(
             "tests/config/example_configuration.yaml"
@@ -24,25 +34,30 @@ class TestMqttReader:
             error_handler=self.mock_error_handler,
         )
 
+    def teardown_method(self):
+        self.mqtt_reader.stop()
+
+    def _wait_for_processing(self):
+        self.mqtt_reader._work_q.join()
+
     def test_run(self):
         mock_modbus = Mock()
         self.mqtt_reader.add_message_callback(mock_modbus.message_callback)
 
         def call_on_connect(*args):
-            callback = self.mqtt_reader._on_connect()
-            callback(self.mock_mqtt_client, None, None, 0, None)
+            self.mqtt_reader._on_connect(self.mock_mqtt_client, None, None, 0, None)
 
         # Assume connect method always successful
         self.mock_mqtt_client.connect.return_value = 0
         self.mock_mqtt_client.connect.side_effect = call_on_connect
 
         # Run the method
-        self.mqtt_reader.run()
+        self.mqtt_reader.start()
 
         # Verify that connect was called with the parameters from the example config
         self.mock_mqtt_client.connect.assert_called_with("mqtt.host", 9000)
         # and it called the callback which subscribed to our topics
-        self.mock_mqtt_client.subscribe.call_count == 1
+        self.mock_mqtt_client.subscribe.assert_called_once_with([("commands/#", 0)])
 
         # Pretend that the MQTT broker received a message and our callback is called
         json_obj = [{"action": "evgBatteryModeCoil", "value": True}]
@@ -53,6 +68,7 @@ class TestMqttReader:
         paho_msg = MQTTMessage()
         paho_msg.payload = json_str.encode()
         self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
         mocked_args, _ = mock_modbus.message_callback.call_args
         mocked_obj = mocked_args[0]
         assert mocked_obj.name == msg_obj.name
@@ -63,21 +79,23 @@ class TestMqttReader:
             json.loads(json_str)
 
         self.mqtt_reader.add_message_callback(read_json)
-        self.mqtt_reader.run()
+        self.mqtt_reader.start()
 
         bad_json_str = "{'invalid', 'json'}"
         paho_msg = MQTTMessage()
         paho_msg.payload = bad_json_str.encode()
         self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
         self.mock_error_handler.publish.assert_called_with(
             self.mock_error_handler.Category.INVALID_MESSAGE,
-            "Message is invalid JSON syntax: Expecting property name enclosed in double quotes: line 1 column 2 (char 1)",  # noqa
+            "Message is invalid JSON syntax: unexpected character, expected a string key: line 1 column 2 (char 1)",  # noqa
         )
 
         bad_json_str = '["list","without","dict"]'
         paho_msg = MQTTMessage()
         paho_msg.payload = bad_json_str.encode()
         self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
         self.mock_error_handler.publish.assert_called_with(
             self.mock_error_handler.Category.INVALID_MESSAGE,
             "Message object must be a dict",
@@ -87,6 +105,7 @@ class TestMqttReader:
         paho_msg = MQTTMessage()
         paho_msg.payload = bad_json_str.encode()
         self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
         self.mock_error_handler.publish.assert_called_with(
             self.mock_error_handler.Category.INVALID_MESSAGE,
             "Message is missing required components 'action' and/or 'value'",
@@ -95,12 +114,13 @@ class TestMqttReader:
         self.mqtt_reader.stop()
 
     def test_unknown_message(self):
-        self.mqtt_reader.run()
+        self.mqtt_reader.start()
 
         unknown_msg = json.dumps([{"action": "noSuchCoil", "value": False}])
         paho_msg = MQTTMessage()
         paho_msg.payload = unknown_msg.encode()
         self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
         self.mock_error_handler.publish.assert_called_with(
             self.mock_error_handler.Category.UNKNOWN_COMMAND,
             "No coil or register found to match 'noSuchCoil'",
@@ -116,34 +136,173 @@ class TestMqttReader:
 
     def test_disconnect(self, caplog):
         self.mock_mqtt_client.connect.return_value = 0
-        self.mqtt_reader.run()
+        self.mqtt_reader.start()
         callback = self.mock_mqtt_client.on_disconnect
-        callback(self.mock_mqtt_client, None, 1, None)
+        callback(self.mock_mqtt_client, None, None, 1, None)
         assert "MQTT client has disconnected: 1" == str(caplog.records[0].message)
 
+    def test_disconnect_from_paho(self, caplog):
+        # Let paho call the handler, so that the callback signature is checked too
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        MqttReader(self.configuration, client, self.mock_error_handler)
+        client._do_on_disconnect(False, mqtt.MQTT_ERR_CONN_LOST)
+        assert "MQTT client has disconnected: Unspecified error" in caplog.messages
+
     def test_fail_connect_rc(self, caplog):
         def call_on_connect(*args):
-            callback = self.mqtt_reader._on_connect()
-            callback(self.mock_mqtt_client, None, None, 1, None)
+            self.mqtt_reader._on_connect(self.mock_mqtt_client, None, None, 1, None)
 
         self.mock_mqtt_client.connect.side_effect = call_on_connect
-        self.mqtt_reader.run()
+        self.mqtt_reader.start()
         self.mqtt_reader.stop()
         assert "Problem connecting to MQTT broker: 1" == str(caplog.records[0].message)
 
-    def test_unhandled_exception(self):
+    def test_unhandled_exception(self, caplog):
+        caplog.set_level(logging.INFO)
+
         def process_message(json_str):
             raise RuntimeError("didn't expect that!")
 
         self.mqtt_reader.add_message_callback(process_message)
-        self.mqtt_reader.run()
+        self.mqtt_reader.start()
 
         paho_msg = MQTTMessage()
         json_str = json.dumps([{"action": "evgBatteryModeCoil", "value": True}])
         paho_msg.payload = json_str.encode()
         self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
         self.mock_error_handler.publish.assert_called_with(
             self.mock_error_handler.Category.UNHANDLED, "didn't expect that!"
         )
+        assert json_str in caplog.messages
 
         self.mqtt_reader.stop()
+
+    def test_worker_survives_failed_error_report(self, caplog):
+        mock_modbus = Mock()
+        mock_modbus.message_callback.side_effect = [RuntimeError("write failed"), None]
+        self.mock_error_handler.publish.side_effect = OSError("broker unreachable")
+        self.mqtt_reader.add_message_callback(mock_modbus.message_callback)
+        self.mqtt_reader.start()
+
+        paho_msg = MQTTMessage(topic=b"commands/test")
+        paho_msg.payload = json.dumps(
+            [{"action": "evgBatteryModeCoil", "value": True}]
+        ).encode()
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
+        assert "Failed to process message on topic commands/test" in caplog.messages
+
+        # The worker is still running and picks up the next message
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
+        assert mock_modbus.message_callback.call_count == 2
+        assert self.mqtt_reader._worker.is_alive()
+
+    def test_message_list_callback(self):
+        mock_modbus = Mock()
+        self.mqtt_reader.add_message_callback(mock_modbus.message_callback)
+        self.mqtt_reader.add_message_list_callback(mock_modbus.message_list_callback)
+        self.mqtt_reader.start()
+
+        json_str = json.dumps(
+            [
+                {"action": "evgBatteryModeCoil", "value": True},
+                {"action": "evgBatteryTargetPowerWattsCoil", "value": False},
+            ]
+        )
+        paho_msg = MQTTMessage()
+        paho_msg.payload = json_str.encode()
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
+        # Message callbacks get one command at a time, list callbacks the whole payload
+        assert [
+            args[0].name for args, _ in mock_modbus.message_callback.call_args_list
+        ] == ["evgBatteryModeCoil", "evgBatteryTargetPowerWattsCoil"]
+        mock_modbus.message_list_callback.assert_called_once()
+        mocked_args, _ = mock_modbus.message_list_callback.call_args
+        assert [msg.name for msg in mocked_args[0]] == [
+            "evgBatteryModeCoil",
+            "evgBatteryTargetPowerWattsCoil",
+        ]
+
+    def test_message_list_callback_only(self):
+        mock_modbus = Mock()
+        self.mqtt_reader.add_message_list_callback(mock_modbus.message_list_callback)
+        self.mqtt_reader.start()
+
+        paho_msg = MQTTMessage()
+        paho_msg.payload = json.dumps(
+            [{"action": "evgBatteryModeCoil", "value": True}]
+        ).encode()
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
+        mock_modbus.message_list_callback.assert_called_once()
+        self.mock_error_handler.publish.assert_not_called()
+
+    def test_run_blocks_until_stopped(self):
+        timer = threading.Timer(0.05, self.mqtt_reader.stop)
+        timer.start()
+        self.mqtt_reader.run()
+        self.mock_mqtt_client.loop_forever.assert_called_once()
+        self.mock_mqtt_client.disconnect.assert_called()
+
+    def test_run_raises_when_network_loop_fails(self, caplog):
+        # e.g. a callback raising inside paho, which would otherwise leave run() waiting
+        self.mock_mqtt_client.loop_forever.side_effect = TypeError("bad callback")
+        with pytest.raises(TypeError, match="bad callback"):
+            self.mqtt_reader.run()
+        assert "MQTT network loop failed: bad callback" in caplog.messages
+
+    def test_multiple_callbacks(self):
+        assert self.mqtt_reader._dispatch is None
+        first, second = Mock(), Mock()
+        self.mqtt_reader.add_message_callback(first)
+        assert self.mqtt_reader._dispatch is first
+        self.mqtt_reader.add_message_callback(second)
+        self.mqtt_reader.start()
+
+        paho_msg = MQTTMessage()
+        paho_msg.payload = json.dumps(
+            [{"action": "evgBatteryModeCoil", "value": True}]
+        ).encode()
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self._wait_for_processing()
+        first.assert_called_once()
+        second.assert_called_once()
+
+    def test_socket_tuned_on_connect(self):
+        self.configuration.mqtt_settings.socket_rcvbuf = 256 * 1024
+        mqtt_reader = MqttReader(
+            configuration=self.configuration,
+            client=self.mock_mqtt_client,
+            error_handler=self.mock_error_handler,
+        )
+        mock_socket = MagicMock(spec=socket.socket)
+        self.mock_mqtt_client.socket.return_value = mock_socket
+        mqtt_reader._on_connect(self.mock_mqtt_client, None, None, 0, None)
+        mock_socket.setsockopt.assert_any_call(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * 1024
+        )
+
+    def test_queue_full(self, caplog):
+        self.mqtt_reader._work_q = queue.Queue(maxsize=1)
+        paho_msg = MQTTMessage(topic=b"commands/test")
+        paho_msg.payload = b"[]"
+        # Without a running worker, the second message has nowhere to go
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self.mock_error_handler.publish.assert_not_called()
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        self.mock_mqtt_client.on_message(self.mock_mqtt_client, None, paho_msg)
+        # The network loop only logs the drop, and the worker reports it
+        self.mock_error_handler.publish.assert_not_called()
+        assert "Command queue is full, dropped message on topic commands/test" in (
+            caplog.messages
+        )
+
+        self.mqtt_reader.start()
+        self._wait_for_processing()
+        self.mock_error_handler.publish.assert_called_once_with(
+            self.mock_error_handler.Category.MQTT_ERROR,
+            "Command queue is full, dropped 2 message(s) on topic commands/test",
+        )
@@ -5,6 +5,8 @@ import paho.mqtt.client as mqtt
 from app.mqtt_writer import MqttWriter
 import pytest
 import json
+import threading
+import time
 
 
 class TestMqttWriter:
@@ -39,3 +41,109 @@ class TestMqttWriter:
         with pytest.raises(OSError) as ex:
             self.mqtt_writer.publish(self.topic, self.payload)
         assert "Cannot connect to MQTT broker" in str(ex.value)
+
+    def test_connection_is_reused(self):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+
+        for _ in range(3):
+            self.mqtt_writer.publish(self.topic, self.payload_str)
+
+        self.mock_mqtt_client.connect.assert_called_once_with("localhost", 1883)
+        self.mock_mqtt_client.loop_start.assert_called_once()
+        assert self.mock_mqtt_client.publish.call_count == 3
+
+    def test_concurrent_publish_connects_once(self):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+        self.mock_mqtt_client.connect.side_effect = lambda *_args: time.sleep(0.05)
+
+        threads = [
+            threading.Thread(
+                target=self.mqtt_writer.publish, args=(self.topic, self.payload_str)
+            )
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.mock_mqtt_client.connect.assert_called_once()
+        assert self.mock_mqtt_client.publish.call_count == 2
+
+    def test_disconnect(self, caplog):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+        self.mqtt_writer.publish(self.topic, self.payload_str)
+        self.mock_mqtt_client.on_connect(self.mock_mqtt_client, None, None, 0, None)
+        self.mock_mqtt_client.on_disconnect(self.mock_mqtt_client, None, None, 1, None)
+        assert "MQTT client has disconnected: 1" == str(caplog.records[0].message)
+
+        # paho's network loop reconnects, so publishing doesn't connect again
+        self.mqtt_writer.publish(self.topic, self.payload_str)
+        self.mock_mqtt_client.connect.assert_called_once()
+
+    def test_disconnect_from_paho(self, caplog):
+        # Let paho call the handler, so that the callback signature is checked too
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        MqttWriter("localhost", 1883, client)
+        client._do_on_disconnect(False, mqtt.MQTT_ERR_CONN_LOST)
+        assert "MQTT client has disconnected: Unspecified error" in caplog.messages
+
+    def test_batch_publish(self):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+        mqtt_writer = MqttWriter(
+            "localhost", 1883, self.mock_mqtt_client, batch_window=10
+        )
+        other_payload_str = json.dumps({"category": "SomeError", "message": "Again"})
+
+        mqtt_writer.publish(self.topic, self.payload_str)
+        mqtt_writer.publish(self.topic, other_payload_str)
+        mqtt_writer.publish("/other/topic", self.payload_str)
+        self.mock_mqtt_client.publish.assert_not_called()
+
+        mqtt_writer.flush()
+        assert self.mock_mqtt_client.publish.call_count == 2
+        self.mock_mqtt_client.publish.assert_any_call(
+            self.topic, f"[{self.payload_str},{other_payload_str}]", qos=1
+        )
+        self.mock_mqtt_client.publish.assert_any_call(
+            "/other/topic", self.payload_str, qos=1
+        )
+        batch = self.mock_mqtt_client.publish.call_args_list[0][0][1]
+        assert json.loads(batch) == [self.payload, json.loads(other_payload_str)]
+
+    def test_batch_timer_flushes(self):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+        mqtt_writer = MqttWriter(
+            "localhost", 1883, self.mock_mqtt_client, batch_window=0.01
+        )
+        mqtt_writer.publish(self.topic, self.payload_str)
+        mqtt_writer._flush_timer.join()
+        self.mock_mqtt_client.publish.assert_called_once_with(
+            self.topic, self.payload_str, qos=1
+        )
+
+    def test_stop_flushes_batch(self):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+        mqtt_writer = MqttWriter(
+            "localhost", 1883, self.mock_mqtt_client, batch_window=10
+        )
+        mqtt_writer.publish(self.topic, self.payload_str)
+        flush_timer = mqtt_writer._flush_timer
+
+        mqtt_writer.stop()
+        self.mock_mqtt_client.publish.assert_called_once_with(
+            self.topic, self.payload_str, qos=1
+        )
+        self.mock_mqtt_client.loop_stop.assert_called_once()
+        flush_timer.join()
+        assert self.mock_mqtt_client.publish.call_count == 1
+
+    def test_urgent_publish(self):
+        self.mock_mqtt_client.publish.return_value = (0, 1)
+        mqtt_writer = MqttWriter(
+            "localhost", 1883, self.mock_mqtt_client, batch_window=10
+        )
+        mqtt_writer.publish(self.topic, self.payload_str, urgent=True)
+        self.mock_mqtt_client.publish.assert_called_once_with(
+            self.topic, self.payload_str, qos=1
+        )
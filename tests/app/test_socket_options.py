@@ -0,0 +1,31 @@
+"""Unit tests for the tune_socket function in the app.socket_options module."""
+
+import socket
+from unittest.mock import MagicMock, call
+from app.socket_options import tune_socket
+
+
+def test_defaults_leave_socket_unchanged():
+    sock = MagicMock(spec=socket.socket)
+    tune_socket(sock)
+    sock.setsockopt.assert_not_called()
+
+
+def test_buffer_sizes_and_nodelay():
+    sock = MagicMock(spec=socket.socket)
+    tune_socket(sock, rcvbuf=256 * 1024, sndbuf=128 * 1024, nodelay=True)
+    sock.setsockopt.assert_has_calls(
+        [
+            call(socket.SOL_SOCKET, socket.SO_RCVBUF, 256 * 1024),
+            call(socket.SOL_SOCKET, socket.SO_SNDBUF, 128 * 1024),
+            call(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        ]
+    )
+
+
+def test_real_socket():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        tune_socket(sock, rcvbuf=64 * 1024, nodelay=True)
+        # Linux doubles the requested size to allow for bookkeeping overhead
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 64 * 1024
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) != 0
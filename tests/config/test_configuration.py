@@ -104,6 +104,7 @@ def test_able_to_get_mqtt_settings():
     assert mqtt_settings.host == "mqtt.host"
     assert mqtt_settings.command_topic == "commands/#"
     assert mqtt_settings.pub_errors is True
+    assert mqtt_settings.error_batch_window == 0.0
 
     config = path_to_yaml_data(_config_path())
 
@@ -117,6 +118,12 @@ def test_able_to_get_mqtt_settings():
     new_mqtt_settings = _mqtt_settings_from_yaml_data(empty_err_topic)
     assert new_mqtt_settings.pub_errors is False
 
+    # `error_batch_window:` with no value loads as None
+    empty_batch_window = deepcopy(config)
+    empty_batch_window["mqtt_settings"]["error_batch_window"] = None
+    new_mqtt_settings = _mqtt_settings_from_yaml_data(empty_batch_window)
+    assert new_mqtt_settings.error_batch_window == 0.0
+
 
 def test_able_to_get_modbus_settings():
     configuration = Configuration.from_file(_config_path())
@@ -125,6 +132,7 @@ def test_able_to_get_modbus_settings():
 
     assert modbus_settings.port == 8080
     assert modbus_settings.host == "modbus.host"
+    assert modbus_settings.idle_timeout is None
 
 
 def test_able_to_get_site():